@@ -1,33 +1,81 @@
 #!/usr/bin/env python3
-"""Benchmark: RocksDB vs LMDB vs SQLite vs Redis for VectorEntry data."""
+"""Benchmark: RocksDB vs LMDB vs SQLite vs Redis (vs a raw file floor) for VectorEntry data."""
 
-import argparse, os, shutil, sqlite3, struct, tempfile, time, random, gc
-from dataclasses import dataclass
+import argparse, mmap, os, shutil, sqlite3, struct, tempfile, time, gc
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
-RESULTS = []
+BATCH = 10_000  # ops per write batch / pipeline chunk
 
-@dataclass
-class VectorEntry:
-    id: int
-    embedding: np.ndarray
-    original_data: str
-    database_id: str
-    created_at: int
+_PACK_Q = struct.Struct("<q").pack
+_PACK_I = struct.Struct("<I").pack
 
-    def serialize(self) -> bytes:
-        emb = self.embedding.tobytes()
-        data = self.original_data.encode()
-        db_id = self.database_id.encode()
-        return struct.pack(f"<q{len(emb)}sI{len(data)}sI{len(db_id)}sq",
-                           self.id, emb, len(data), data, len(db_id), db_id, self.created_at)
+def iter_kv(n: int, dim: int, seed: int = 0):
+    """Yield (key, payload) pairs, payload being a serialized VectorEntry record:
+    <q id><f4 * dim embedding><I len>data<I len>database_id<q created_at>.
+    The 8-byte key doubles as the payload's id field."""
+    # seeded PCG64 drawing float32 directly: no float64 intermediate, same data every run
+    rng = np.random.default_rng(seed)
+    mat = rng.random((n, dim), dtype=np.float32)  # one allocation, rows are views
+    ids = np.arange(n, dtype="<i8").tobytes()
+    db_id = b"bench_db"
+    tail = _PACK_I(len(db_id)) + db_id + _PACK_Q(int(time.time() * 1000))
+    for i in range(n):
+        key = ids[i * 8:i * 8 + 8]
+        data = b"data_%d" % i
+        yield key, b"".join((key, mat[i].tobytes(), _PACK_I(len(data)), data, tail))
 
-def generate_entries(n: int, dim: int) -> list[VectorEntry]:
-    ts = int(time.time() * 1000)
-    return [VectorEntry(i, np.random.rand(dim).astype(np.float32), f"data_{i}", "bench_db", ts) for i in range(n)]
+class PayloadFile:
+    """Payloads concatenated in one mmap'd file and sliced out by offset, so the
+    working set between backends is the OS page cache rather than Python bytes."""
+
+    def __init__(self, path: str, lengths: list[int]):
+        self.offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1: return self.take(np.arange(start, stop, step))
+            off = self.offsets[start:stop + 1].tolist()
+            return [self.mm[a:b] for a, b in zip(off, off[1:])]
+        i = range(len(self))[i]  # list semantics: negative indices, IndexError
+        return self.mm[self.offsets[i]:self.offsets[i + 1]]
+
+    def take(self, idx: np.ndarray) -> list[bytes]:
+        """Payloads at arbitrary (non-negative) indices, offsets gathered in one pass"""
+        starts, ends = self.offsets[idx].tolist(), self.offsets[idx + 1].tolist()
+        return [self.mm[a:b] for a, b in zip(starts, ends)]
+
+    def __iter__(self):
+        for i in range(0, len(self), BATCH): yield from self[i:i + BATCH]
+
+    def close(self):
+        self.mm.close()
+
+def spill_kv(kv, path: str) -> tuple[list[bytes], PayloadFile]:
+    """Write payloads from (key, payload) pairs to path, keep only the keys in memory"""
+    keys, lengths = [], []
+    with open(path, "wb") as f:
+        for k, v in kv:
+            keys.append(k)
+            lengths.append(f.write(v))
+    return keys, PayloadFile(path, lengths)
 
 def dir_size(path: str) -> int:
-    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+    total = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False):
+                total += entry.stat(follow_symlinks=False).st_size
+            elif entry.is_dir(follow_symlinks=False):
+                total += dir_size(entry.path)
+    return total
 
 def human_size(b: int) -> str:
     for u in ("B", "KB", "MB", "GB"):
@@ -35,41 +83,129 @@ def human_size(b: int) -> str:
         b /= 1024
     return f"{b:.1f} TB"
 
-def measure_read(read_fn, entries, iterations=3):
-    """Run read benchmark multiple times, return median"""
+def drop_page_cache(*paths: str):
+    """Evict files (or whole directory trees) from the OS page cache. Pages still
+    mapped by a live mmap are not evicted, so callers unmap or close first."""
+    for path in paths:
+        if os.path.isdir(path):
+            drop_page_cache(*(e.path for e in os.scandir(path)))
+        elif os.path.isfile(path):
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fdatasync(fd)  # dirty pages cannot be dropped
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+
+def cold_reads(drop_cache, evict):
+    """measure_read kwargs for --drop-cache: no warmup, evict() before every pass"""
+    return {"warmup": 0, "before": evict} if drop_cache else {}
+
+def measure_read(read_fn, items, iterations=5, warmup=1, threads=1, before=None):
+    """Run read benchmark after untimed warmup passes, return mean without min/max.
+    With threads > 1, items are split into contiguous chunks read concurrently.
+    before() runs untimed ahead of every timed pass."""
+    if threads > 1:
+        step = -(-len(items) // threads)
+        chunks = [items[i:i + step] for i in range(0, len(items), step)]
+        pool = ThreadPoolExecutor(threads)
+        run = lambda: list(pool.map(read_fn, chunks))
+    else:
+        pool = None
+        run = lambda: read_fn(items)
     times = []
-    for _ in range(iterations):
-        t0 = time.perf_counter()
-        read_fn(entries)
-        times.append(time.perf_counter() - t0)
-    return sorted(times)[len(times)//2]
+    try:
+        for _ in range(warmup): run()
+        for _ in range(iterations):
+            if before: before()
+            t0 = time.perf_counter_ns()
+            run()
+            times.append(time.perf_counter_ns() - t0)
+    finally:
+        if pool: pool.shutdown()
+    times.sort()
+    trimmed = times[1:-1] if len(times) > 2 else times
+    return sum(trimmed) / len(trimmed) / 1e9
+
+# ── Raw file ─────────────────────────────────────────────────────────────────
+def bench_rawfile(payloads, tmp, drop_cache=False):
+    """Floor for the DB numbers: [u32 len][payload] records in one flat file, read via mmap"""
+    path = os.path.join(tmp, "raw.bin")
+    t0 = time.perf_counter()
+    with open(path, "wb") as f:
+        # payloads are fetched per BATCH like the DB backends; one write per batch
+        for i in range(0, len(payloads), BATCH):
+            f.write(b"".join([b for v in payloads[i:i + BATCH] for b in (_PACK_I(len(v)), v)]))
+    write_sec = time.perf_counter() - t0
+    size = os.path.getsize(path)
+
+    # the offset table plays the role of a DB index, built outside the timers
+    prefixes = 4 * np.arange(1, len(payloads) + 1)
+    starts = (payloads.offsets[:-1] + prefixes).tolist()
+    ends = (payloads.offsets[1:] + prefixes).tolist()
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read_all(spans):
+        for a, b in spans: _ = mm[a:b]
+
+    def evict():
+        mm.madvise(mmap.MADV_DONTNEED)  # unmap our pages so the file's can be dropped
+        drop_page_cache(path)
+
+    read_sec = measure_read(read_all, list(zip(starts, ends)), **cold_reads(drop_cache, evict))
+    mm.close()
+    return ("RawFile", write_sec, read_sec, size)
 
 # ── RocksDB ──────────────────────────────────────────────────────────────────
-def bench_rocksdb(entries, tmp):
+def bench_rocksdb(keys, payloads, tmp, threads=1, drop_cache=False):
     try:
-        from rocksdict import Rdict
+        from rocksdict import Rdict, Options, BlockBasedOptions, DBCompressionType, WriteBatch
     except ImportError:
         print("  [skip] rocksdict"); return
 
+    # Bulk-ingest tuning: big memtables, early L0 compaction, 64 KB blocks
+    opts = Options()
+    opts.create_if_missing(True)
+    opts.set_write_buffer_size(256 << 20)
+    opts.set_max_write_buffer_number(4)
+    opts.set_level_zero_file_num_compaction_trigger(2)
+    opts.set_target_file_size_base(64 << 20)
+    opts.set_compression_type(DBCompressionType.lz4())
+    opts.set_bottommost_compression_type(DBCompressionType.zstd())
+    table_opts = BlockBasedOptions()
+    table_opts.set_block_size(64 << 10)
+    opts.set_block_based_table_factory(table_opts)
+    # O_DIRECT reads bypass the page cache, so cold reads hit the SSTs on disk
+    opts.set_use_direct_reads(drop_cache)
+
     path = os.path.join(tmp, "rocksdb")
-    db = Rdict(path)
+    db = Rdict(path, opts)
     t0 = time.perf_counter()
-    for e in entries: db[struct.pack("<q", e.id)] = e.serialize()
+    for i in range(0, len(keys), BATCH):
+        wb = WriteBatch()
+        for k, v in zip(keys[i:i + BATCH], payloads[i:i + BATCH]): wb.put(k, v)
+        db.write(wb)
     db.flush()
     write_sec = time.perf_counter() - t0
     
     size = dir_size(path)
     
-    # Read WITHOUT reopening (fair comparison with LMDB)
-    def read_all(entries):
-        for e in entries: _ = db[struct.pack("<q", e.id)]
+    # Read WITHOUT reopening (fair comparison with LMDB); --drop-cache reopens per pass below
+    def read_all(keys):
+        for i in range(0, len(keys), BATCH): _ = db[keys[i:i + BATCH]]  # multi_get
     
-    read_sec = measure_read(read_all, entries)
+    def reopen():
+        nonlocal db
+        db.close()  # RocksDB's block cache lives with the DB, so reopen to empty it
+        db = Rdict(path, opts)
+
+    read_sec = measure_read(read_all, keys, threads=threads, **cold_reads(drop_cache, reopen))
     db.close()
-    RESULTS.append(("RocksDB", write_sec, read_sec, size))
+    return ("RocksDB", write_sec, read_sec, size)
 
 # ── LMDB ─────────────────────────────────────────────────────────────────────
-def bench_lmdb(entries, tmp):
+def bench_lmdb(keys, payloads, tmp, threads=1, drop_cache=False):
     try:
         import lmdb
     except ImportError:
@@ -77,104 +213,152 @@ def bench_lmdb(entries, tmp):
 
     path = os.path.join(tmp, "lmdb")
     os.makedirs(path)
-    env = lmdb.open(path, map_size=10 * 1024**3)
+    # writemap + async/no metasync: LMDB's equivalent of synchronous=OFF
+    env = lmdb.open(path, map_size=10 * 1024**3, writemap=True, map_async=True, metasync=False)
 
+    # MDB_APPEND skips the B-tree descent but needs keys in byte order,
+    # which little-endian ids are not, so the key order is computed untimed;
+    # payloads are fetched per BATCH inside the timer like every other backend
+    order = np.array(sorted(range(len(keys)), key=keys.__getitem__), dtype=np.int64)
+    sorted_keys = [keys[i] for i in order.tolist()]
+    added = 0
     t0 = time.perf_counter()
-    with env.begin(write=True) as txn:
-        for e in entries: txn.put(struct.pack("<q", e.id), e.serialize())
+    with env.begin(write=True) as txn, txn.cursor() as cur:
+        for i in range(0, len(order), BATCH):
+            _, n = cur.putmulti(zip(sorted_keys[i:i + BATCH], payloads.take(order[i:i + BATCH])),
+                                append=True, overwrite=False)
+            added += n
     write_sec = time.perf_counter() - t0
+    assert added == len(keys), f"LMDB append stopped after {added}/{len(keys)} keys"
+    del order, sorted_keys
     env.sync()
-    size = dir_size(path)
+    # writemap preallocates the whole map, so count used pages instead of file size
+    size = (env.info()["last_pgno"] + 1) * env.stat()["psize"]
 
-    def read_all(entries):
+    # one read txn per call, so each worker thread gets its own MVCC snapshot
+    def read_all(keys):
         with env.begin() as txn:
-            for e in entries: _ = txn.get(struct.pack("<q", e.id))
+            for k in keys: _ = txn.get(k)
     
-    read_sec = measure_read(read_all, entries)
+    def reopen():
+        nonlocal env
+        env.close()  # the live mmap pins the file's pages, so unmap before evicting
+        drop_page_cache(path)
+        env = lmdb.open(path, map_size=10 * 1024**3, readonly=True)
+
+    read_sec = measure_read(read_all, keys, threads=threads, **cold_reads(drop_cache, reopen))
     env.close()
-    RESULTS.append(("LMDB", write_sec, read_sec, size))
+    return ("LMDB", write_sec, read_sec, size)
 
 # ── SQLite ───────────────────────────────────────────────────────────────────
-def bench_sqlite(entries, tmp):
+def bench_sqlite(payloads, tmp, drop_cache=False):
     path = os.path.join(tmp, "sqlite.db")
     conn = sqlite3.connect(path)
+    # Bulk-load tuning: durability is irrelevant for a throwaway benchmark db
+    conn.execute("PRAGMA locking_mode=EXCLUSIVE")
     conn.execute("PRAGMA journal_mode=WAL")
-    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-262144")
     conn.execute("CREATE TABLE vectors (id INTEGER PRIMARY KEY, data BLOB)")
 
     t0 = time.perf_counter()
-    conn.executemany("INSERT INTO vectors VALUES (?, ?)", [(e.id, e.serialize()) for e in entries])
+    conn.executemany("INSERT INTO vectors VALUES (?, ?)", enumerate(payloads))
     conn.commit()
     write_sec = time.perf_counter() - t0
     size = os.path.getsize(path)
 
+    # Point lookups batched into IN (...) lists; 999 is SQLite's historical
+    # bound-parameter limit, and a fixed SQL string hits the statement cache
+    chunk = 999
+    select = f"SELECT data FROM vectors WHERE id IN ({','.join('?' * chunk)})"
     cur = conn.cursor()
-    def read_all(entries):
-        for e in entries:
-            cur.execute("SELECT data FROM vectors WHERE id=?", (e.id,))
-            cur.fetchone()
+    def read_all(ids):
+        for i in range(0, len(ids), chunk):
+            batch = ids[i:i + chunk]
+            sql = select if len(batch) == chunk else \
+                f"SELECT data FROM vectors WHERE id IN ({','.join('?' * len(batch))})"
+            cur.execute(sql, batch).fetchall()
     
-    read_sec = measure_read(read_all, entries)
+    def reopen():
+        nonlocal conn, cur
+        conn.close()  # discards SQLite's private page cache along with the connection
+        drop_page_cache(path, path + "-wal")
+        conn = sqlite3.connect(path)
+        cur = conn.cursor()
+
+    read_sec = measure_read(read_all, range(len(payloads)), **cold_reads(drop_cache, reopen))
     conn.close()
-    RESULTS.append(("SQLite", write_sec, read_sec, size))
+    return ("SQLite", write_sec, read_sec, size)
 
 # ── Redis ────────────────────────────────────────────────────────────────────
-def bench_redis(entries, url):
+def bench_redis(payloads, url, drop_cache=False):
     try:
         import redis
         r = redis.from_url(url)
         r.ping()
-        key_prefix = "vbench:"
         r.flushdb()
 
+        # bytes keys go through redis-py's encoder untouched
+        bkeys = [b"vbench:%d" % i for i in range(len(payloads))]
         t0 = time.perf_counter()
-        pipe = r.pipeline()
-        for e in entries: pipe.set(f"{key_prefix}{e.id}", e.serialize())
-        pipe.execute()
+        for i in range(0, len(bkeys), BATCH):
+            r.mset(dict(zip(bkeys[i:i + BATCH], payloads[i:i + BATCH])))
         write_sec = time.perf_counter() - t0
 
         info = r.info("memory")
         size = info.get("used_memory_dataset", info.get("used_memory", 0))
 
-        def read_all(entries):
-            pipe = r.pipeline()
-            for e in entries: pipe.get(f"{key_prefix}{e.id}")
-            pipe.execute()
+        # replies are dropped per batch, so at most BATCH payloads are alive at once
+        def read_all(bkeys):
+            for i in range(0, len(bkeys), BATCH): r.mget(bkeys[i:i + BATCH])
 
-        read_sec = measure_read(read_all, entries)
+        read_sec = measure_read(read_all, bkeys)
         r.flushdb()
-        RESULTS.append(("Redis", write_sec, read_sec, size))
+        # in-memory by design, so there is nothing to evict under --drop-cache
+        return ("Redis (warm)" if drop_cache else "Redis", write_sec, read_sec, size)
     except Exception as e:
         print(f"  [skip] Redis: {e}")
 
 # ── Main ─────────────────────────────────────────────────────────────────────
-def run_single(n, dim, redis_url, no_redis):
-    global RESULTS
-    RESULTS = []
+def run_single(n, dim, redis_url, no_redis, read_threads=1, drop_cache=False):
+    results = []
     gc.collect()
     
-    entries = generate_entries(n, dim)
     tmp = tempfile.mkdtemp(prefix="vbench_")
+    payloads = None
     try:
-        bench_rocksdb(entries, tmp)
+        keys, payloads = spill_kv(iter_kv(n, dim), os.path.join(tmp, "payloads.bin"))  # shared by every backend
+        results.append(bench_rawfile(payloads, tmp, drop_cache))
+        gc.collect()
+        results.append(bench_rocksdb(keys, payloads, tmp, read_threads, drop_cache))
         gc.collect()
-        bench_lmdb(entries, tmp)
+        results.append(bench_lmdb(keys, payloads, tmp, read_threads, drop_cache))
         gc.collect()
-        bench_sqlite(entries, tmp)
+        results.append(bench_sqlite(payloads, tmp, drop_cache))
         gc.collect()
-        if not no_redis: bench_redis(entries, redis_url)
+        if not no_redis: results.append(bench_redis(payloads, redis_url, drop_cache))
     finally:
+        if payloads is not None: payloads.close()
         shutil.rmtree(tmp, ignore_errors=True)
-    return RESULTS.copy()
+    return [r for r in results if r]  # skipped backends return None
 
 def main():
     p = argparse.ArgumentParser()
     p.add_argument("-n", type=int, default=None, help="single run with N entries")
     p.add_argument("-d", "--dim", type=int, default=None, help="single run with DIM")
-    p.add_argument("--redis-url", default="redis://localhost:6379/0")
+    p.add_argument("--redis-url", default="redis://localhost:6379/0",
+                   help="e.g. unix:///var/run/redis/redis.sock to skip TCP for a local server")
     p.add_argument("--no-redis", action="store_true")
     p.add_argument("--full", action="store_true", help="run full matrix benchmark")
+    p.add_argument("--read-threads", type=int, default=1,
+                   help="split RocksDB/LMDB reads across N threads (0 = cpu count)")
+    p.add_argument("--drop-cache", action="store_true",
+                   help="cold reads: reopen/evict on-disk stores before every read pass (Redis stays warm)")
     args = p.parse_args()
+    if args.drop_cache and not hasattr(os, "posix_fadvise"):
+        p.error("--drop-cache needs os.posix_fadvise (Linux)")
+    read_threads = args.read_threads or os.cpu_count()
 
     if args.full:
         ns = [100_000, 200_000, 500_000, 1_000_000]
@@ -183,9 +367,11 @@ def main():
         for dim in dims:
             for n in ns:
                 print(f"\n=== n={n:,} dim={dim} ===")
-                results = run_single(n, dim, args.redis_url, args.no_redis)
+                results = run_single(n, dim, args.redis_url, args.no_redis, read_threads, args.drop_cache)
                 for name, w, r, s in results:
                     all_results.append((n, dim, name, w, r, s))
+                del results
+                gc.collect(); gc.collect()  # keep one run's garbage out of the next run's timings
         
         print("\n\n## Full Results Matrix\n")
         print("| N | Dim | Storage | Write (s) | Read (s) | Size |")
@@ -196,7 +382,7 @@ def main():
         n = args.n or 100_000
         dim = args.dim or 128
         print(f"Generating {n:,} entries (dim={dim})...")
-        results = run_single(n, dim, args.redis_url, args.no_redis)
+        results = run_single(n, dim, args.redis_url, args.no_redis, read_threads, args.drop_cache)
         print("\n## Results\n")
         print("| Storage | Write (s) | Read (s) | Size |")
         print("|---------|-----------|----------|------|")